@@ -0,0 +1,134 @@
+"""
+Benchmarks comparing the fast/approximate paths against the reference ones.
+
+Run:
+  python -m audio_sep_cli.bench key stem1.wav stem2.wav ...
+  python -m audio_sep_cli.bench separation song1.mp3 song2.wav ... --model htdemucs
+"""
+from pathlib import Path
+import time
+import numpy as np
+import soundfile as sf
+import typer
+from rich import print
+
+from .segment import extract_segment_to_wav
+from .separate import run_demucs
+from .separate_onnx import DEFAULT_CACHE_DIR, ONNX_MODELS, prepare_onnx_model, run_demucs_onnx
+from .keydetect import estimate_key_label_for_wav, estimate_key_windowed_for_wav
+
+app = typer.Typer(add_completion=False, no_args_is_help=True)
+
+@app.callback()
+def main():
+    """Speed/accuracy comparisons on local audio fixtures."""
+
+@app.command()
+def key(
+    wav_files: list[Path] = typer.Argument(..., exists=True, readable=True, help="WAV stems to compare."),
+    key_window: float = typer.Option(8.0, "--key-window", help="Window length in seconds for the windowed mode."),
+    key_max_windows: int = typer.Option(6, "--key-max-windows", help="Maximum number of windows per stem for the windowed mode."),
+):
+    """Compare windowed key estimation against the full-length result (label and runtime)."""
+    if key_window <= 0:
+        raise typer.BadParameter(f"--key-window must be positive, got {key_window}")
+    if key_max_windows < 1:
+        raise typer.BadParameter(f"--key-max-windows must be at least 1, got {key_max_windows}")
+    print("[bold]== KEY BENCH ==[/bold]")
+    matches = 0
+    t_full_total = 0.0
+    t_win_total = 0.0
+    for wav in wav_files:
+        t0 = time.perf_counter()
+        full = estimate_key_label_for_wav(wav)
+        t1 = time.perf_counter()
+        win = estimate_key_windowed_for_wav(wav, window_s=key_window, max_windows=key_max_windows)
+        t2 = time.perf_counter()
+        t_full_total += t1 - t0
+        t_win_total += t2 - t1
+        same = win["label"] == full
+        matches += int(same)
+        mark = "[green]=[/green]" if same else "[red]≠[/red]"
+        used = "full" if win["full"] else win["windows"]
+        print(
+            f" - {wav.name}: full={full:<5} {t1 - t0:6.2f}s | "
+            f"windowed={win['label']:<5} (2nd {win['second']}, conf {win['confidence']:.2f}, "
+            f"windows={used}) {t2 - t1:6.2f}s {mark}"
+        )
+    speedup = t_full_total / t_win_total if t_win_total > 0 else float("inf")
+    print(f"\n Agreement: {matches}/{len(wav_files)}")
+    print(f" Total time: full={t_full_total:.2f}s windowed={t_win_total:.2f}s (x{speedup:.1f})\n")
+
+def _sdr(ref: np.ndarray, est: np.ndarray) -> float:
+    """Signal-to-distortion ratio (dB) of `est` against `ref`, trimmed to a common length."""
+    n = min(len(ref), len(est))
+    ref, est = ref[:n], est[:n]
+    num = float(np.sum(ref ** 2))
+    den = float(np.sum((ref - est) ** 2))
+    return 10.0 * np.log10((num + 1e-9) / (den + 1e-9))
+
+@app.command()
+def separation(
+    input_files: list[Path] = typer.Argument(..., exists=True, readable=True, help="Audio fixtures to separate."),
+    out_dir: Path = typer.Option(Path("out") / "bench", "--out", "-o"),
+    start: float = typer.Option(0.0, "--start", help="Start time in seconds"),
+    end: float = typer.Option(None, "--end", help="End time in seconds (optional)"),
+    model: str = typer.Option("htdemucs", "--model", help=f"Demucs model name ({', '.join(ONNX_MODELS)})."),
+    int8: bool = typer.Option(True, "--int8/--no-int8", help="Also benchmark the dynamic int8 ONNX model."),
+    onnx_intra_threads: int = typer.Option(0, "--onnx-intra-threads", help="ONNX Runtime intra-op threads (0 = auto)."),
+    onnx_inter_threads: int = typer.Option(0, "--onnx-inter-threads", help="ONNX Runtime inter-op threads (0 = auto)."),
+    onnx_cache: Path = typer.Option(DEFAULT_CACHE_DIR, "--onnx-cache", help="Directory for exported ONNX models."),
+):
+    """Compare ONNX Runtime separation (fp32/int8) against the PyTorch Demucs output (speed and SDR)."""
+    if model not in ONNX_MODELS:
+        raise typer.BadParameter(f"--engine onnx does not support model '{model}' (use one of: {', '.join(ONNX_MODELS)})")
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # Export/quantize up front so the one-time cost is not counted as inference time.
+    prepare_onnx_model(model, onnx_cache, quantize=int8)
+    variants = [False, True] if int8 else [False]
+
+    print(f"[bold]== SEPARATION BENCH ({model}) ==[/bold]")
+    for input_file in input_files:
+        mix_wav = out_dir / f"{input_file.stem}.wav"
+        extract_segment_to_wav(input_file, mix_wav, start=start, end=end)
+
+        t0 = time.perf_counter()
+        # No random time shift, so the reference is deterministic and only the backend differs.
+        ref_dir = run_demucs(mix_wav, out_dir=out_dir / "torch", model=model, shifts=0)
+        t_ref = time.perf_counter() - t0
+        print(f" - {input_file.name}: torch {t_ref:6.2f}s")
+
+        for quantize in variants:
+            label = "onnx-int8" if quantize else "onnx"
+            t0 = time.perf_counter()
+            est_dir = run_demucs_onnx(
+                mix_wav,
+                out_dir=out_dir / label,
+                model=model,
+                cache_dir=onnx_cache,
+                quantize=quantize,
+                intra_threads=onnx_intra_threads,
+                inter_threads=onnx_inter_threads,
+            )
+            t_est = time.perf_counter() - t0
+
+            sdrs = {}
+            for ref_wav in sorted(ref_dir.glob("*.wav")):
+                est_wav = est_dir / ref_wav.name
+                if not est_wav.exists():
+                    continue
+                ref, _ = sf.read(str(ref_wav), dtype="float32", always_2d=True)
+                est, _ = sf.read(str(est_wav), dtype="float32", always_2d=True)
+                sdrs[ref_wav.stem] = _sdr(ref, est)
+
+            mean_sdr = float(np.mean(list(sdrs.values()))) if sdrs else float("nan")
+            per_stem = ", ".join(f"{k}={v:.1f}" for k, v in sdrs.items())
+            speedup = t_ref / t_est if t_est > 0 else float("inf")
+            print(f"   {label:>9} {t_est:6.2f}s (x{speedup:.1f}) | SDR vs torch {mean_sdr:5.1f} dB ({per_stem})")
+
+        mix_wav.unlink(missing_ok=True)
+    print("")
+
+if __name__ == "__main__":
+    app()
@@ -24,7 +24,9 @@ from rich import print
 from . import __version__
 from .segment import extract_segment_to_wav
 from .separate import run_demucs
-from .keydetect import estimate_key_label_for_wav
+from .cpu_budget import apply_cpu_budget, parse_cores, plan_cpu_budget
+from .separate_onnx import DEFAULT_CACHE_DIR, ENGINES, ONNX_MODELS, run_demucs_onnx
+from .keydetect import KEY_MODES, estimate_key_label_for_wav, estimate_key_windowed_for_wav
 from .drums import slice_and_classify_drum_hits
 from .notes import slice_stem_into_events, estimate_pitch_note_for_wav
 
@@ -37,6 +39,11 @@ def _version_callback(value: bool):
         print(f"audio-sep-cli {__version__}")
         raise typer.Exit()
 
+def _estimate_key(wav: Path, key_mode: str, key_window: float, key_max_windows: int) -> dict:
+    if key_mode == "windowed":
+        return estimate_key_windowed_for_wav(wav, window_s=key_window, max_windows=key_max_windows)
+    return {"label": estimate_key_label_for_wav(wav)}
+
 @app.callback(invoke_without_command=True)
 def main(
     ctx: typer.Context,
@@ -48,16 +55,26 @@ def main(
     model: str = typer.Option("htdemucs", "--model", help="Demucs model name (try htdemucs_6s for piano/guitar)"),
     stems_only: bool = typer.Option(False, "--stems-only", help="Only write stems (skip drum hit slicing)."),
     drum_hits: bool = typer.Option(False, "--drum-hits/--no-drum-hits", help="Slice drum stem into hits and classify."),
-    hit_pre: float = typer.Option(0.03, "--hit-pre", help="Seconds before onset to include in a hit."),
-    hit_post: float = typer.Option(0.25, "--hit-post", help="Seconds after onset to include in a hit."),
-    hit_min_interval: float = typer.Option(0.06, "--hit-min-interval", help="Minimum interval between onsets (seconds)."),
+    hit_pre: float | None = typer.Option(None, "--hit-pre", help="Seconds before onset to include in a hit (default: drums profile)."),
+    hit_post: float | None = typer.Option(None, "--hit-post", help="Seconds after onset to include in a hit (default: drums profile)."),
+    hit_min_interval: float | None = typer.Option(None, "--hit-min-interval", help="Minimum interval between onsets (seconds, default: drums profile)."),
     note_slices: bool = typer.Option(False, "--note-slices/--no-note-slices", help="Slice tonal stems into event WAVs (note/chord/phrase)."),
     note_stems: str = typer.Option("bass,guitar,piano,vocals,other", "--note-stems", help="Comma-separated stems to slice when --note-slices is enabled."),
-    note_pre: float = typer.Option(0.01, "--note-pre", help="Seconds before onset to include in a slice."),
-    note_post: float = typer.Option(0.60, "--note-post", help="Seconds after onset to include in a slice."),
-    note_min_interval: float = typer.Option(0.08, "--note-min-interval", help="Minimum interval between onsets for tonal slicing (seconds)."),
-    note_delta: float = typer.Option(0.15, "--note-delta", help="Onset detector sensitivity for tonal slicing (higher=less sensitive)."),
+    note_pre: float | None = typer.Option(None, "--note-pre", help="Seconds before onset to include in a slice (default: stem profile)."),
+    note_post: float | None = typer.Option(None, "--note-post", help="Seconds after onset to include in a slice (default: stem profile)."),
+    note_min_interval: float | None = typer.Option(None, "--note-min-interval", help="Minimum interval between onsets for tonal slicing (seconds, default: stem profile)."),
+    note_delta: float | None = typer.Option(None, "--note-delta", help="Onset detector sensitivity for tonal slicing (higher=less sensitive, default: stem profile)."),
     note_max_events: int | None = typer.Option(None, "--note-max-events", help="Limit number of slices per stem (for testing)."),
+    key_mode: str = typer.Option("full", "--key-mode", help="Key estimation: 'full' (whole stem) or 'windowed' (sampled high-energy windows)."),
+    key_window: float = typer.Option(8.0, "--key-window", help="Window length in seconds for --key-mode windowed."),
+    key_max_windows: int = typer.Option(6, "--key-max-windows", help="Maximum number of windows per stem for --key-mode windowed."),
+    engine: str = typer.Option("torch", "--engine", help="Separation backend: 'torch' (Demucs CLI) or 'onnx' (ONNX Runtime, CPU)."),
+    onnx_int8: bool = typer.Option(False, "--onnx-int8/--no-onnx-int8", help="Use dynamic int8 quantization with --engine onnx (faster, lower quality)."),
+    onnx_intra_threads: int = typer.Option(0, "--onnx-intra-threads", help="ONNX Runtime intra-op threads (0 = auto)."),
+    onnx_inter_threads: int = typer.Option(0, "--onnx-inter-threads", help="ONNX Runtime inter-op threads (0 = auto)."),
+    onnx_cache: Path = typer.Option(DEFAULT_CACHE_DIR, "--onnx-cache", help="Directory for exported ONNX models."),
+    cpu_budget: int | None = typer.Option(None, "--cpu-budget", help="Maximum CPU threads for separation and analysis (default: all available cores)."),
+    cpu_cores: str | None = typer.Option(None, "--cpu-cores", help="Pin the job to these cores, e.g. '0-3' or '0,2,4' (Linux only)."),
     version: bool = typer.Option(False, "--version", "-V", help="Show version and exit.", callback=_version_callback),
 ):
     # If no subcommand was invoked, run default action.
@@ -83,6 +100,16 @@ def main(
             note_min_interval=note_min_interval,
             note_delta=note_delta,
             note_max_events=note_max_events,
+            key_mode=key_mode,
+            key_window=key_window,
+            key_max_windows=key_max_windows,
+            engine=engine,
+            onnx_int8=onnx_int8,
+            onnx_intra_threads=onnx_intra_threads,
+            onnx_inter_threads=onnx_inter_threads,
+            onnx_cache=onnx_cache,
+            cpu_budget=cpu_budget,
+            cpu_cores=cpu_cores,
         )
 
 @app.command()
@@ -94,20 +121,56 @@ def separate(
     model: str = typer.Option("htdemucs", "--model", help="Demucs model name (try htdemucs_6s for piano/guitar)"),
     stems_only: bool = typer.Option(False, "--stems-only", help="Only write stems (skip drum hit slicing)."),
     drum_hits: bool = typer.Option(False, "--drum-hits/--no-drum-hits", help="Slice drum stem into hits and classify."),
-    hit_pre: float = typer.Option(0.03, "--hit-pre", help="Seconds before onset to include in a hit."),
-    hit_post: float = typer.Option(0.25, "--hit-post", help="Seconds after onset to include in a hit."),
-    hit_min_interval: float = typer.Option(0.06, "--hit-min-interval", help="Minimum interval between onsets (seconds)."),
+    hit_pre: float | None = typer.Option(None, "--hit-pre", help="Seconds before onset to include in a hit (default: drums profile)."),
+    hit_post: float | None = typer.Option(None, "--hit-post", help="Seconds after onset to include in a hit (default: drums profile)."),
+    hit_min_interval: float | None = typer.Option(None, "--hit-min-interval", help="Minimum interval between onsets (seconds, default: drums profile)."),
     note_slices: bool = typer.Option(False, "--note-slices/--no-note-slices", help="Slice tonal stems into event WAVs (note/chord/phrase)."),
     note_stems: str = typer.Option("bass,guitar,piano,vocals,other", "--note-stems", help="Comma-separated stems to slice when --note-slices is enabled."),
-    note_pre: float = typer.Option(0.01, "--note-pre", help="Seconds before onset to include in a slice."),
-    note_post: float = typer.Option(0.60, "--note-post", help="Seconds after onset to include in a slice."),
-    note_min_interval: float = typer.Option(0.08, "--note-min-interval", help="Minimum interval between onsets for tonal slicing (seconds)."),
-    note_delta: float = typer.Option(0.15, "--note-delta", help="Onset detector sensitivity for tonal slicing (higher=less sensitive)."),
+    note_pre: float | None = typer.Option(None, "--note-pre", help="Seconds before onset to include in a slice (default: stem profile)."),
+    note_post: float | None = typer.Option(None, "--note-post", help="Seconds after onset to include in a slice (default: stem profile)."),
+    note_min_interval: float | None = typer.Option(None, "--note-min-interval", help="Minimum interval between onsets for tonal slicing (seconds, default: stem profile)."),
+    note_delta: float | None = typer.Option(None, "--note-delta", help="Onset detector sensitivity for tonal slicing (higher=less sensitive, default: stem profile)."),
     note_max_events: int | None = typer.Option(None, "--note-max-events", help="Limit number of slices per stem (for testing)."),
+    key_mode: str = typer.Option("full", "--key-mode", help="Key estimation: 'full' (whole stem) or 'windowed' (sampled high-energy windows)."),
+    key_window: float = typer.Option(8.0, "--key-window", help="Window length in seconds for --key-mode windowed."),
+    key_max_windows: int = typer.Option(6, "--key-max-windows", help="Maximum number of windows per stem for --key-mode windowed."),
+    engine: str = typer.Option("torch", "--engine", help="Separation backend: 'torch' (Demucs CLI) or 'onnx' (ONNX Runtime, CPU)."),
+    onnx_int8: bool = typer.Option(False, "--onnx-int8/--no-onnx-int8", help="Use dynamic int8 quantization with --engine onnx (faster, lower quality)."),
+    onnx_intra_threads: int = typer.Option(0, "--onnx-intra-threads", help="ONNX Runtime intra-op threads (0 = auto)."),
+    onnx_inter_threads: int = typer.Option(0, "--onnx-inter-threads", help="ONNX Runtime inter-op threads (0 = auto)."),
+    onnx_cache: Path = typer.Option(DEFAULT_CACHE_DIR, "--onnx-cache", help="Directory for exported ONNX models."),
+    cpu_budget: int | None = typer.Option(None, "--cpu-budget", help="Maximum CPU threads for separation and analysis (default: all available cores)."),
+    cpu_cores: str | None = typer.Option(None, "--cpu-cores", help="Pin the job to these cores, e.g. '0-3' or '0,2,4' (Linux only)."),
 ):
     """Separate an audio file (or a time segment) into stems and write WAV outputs."""
     if input_file.suffix.lower() not in SUPPORTED_EXTS:
         raise typer.BadParameter(f"Unsupported format: {input_file.suffix}")
+    if key_mode not in KEY_MODES:
+        raise typer.BadParameter(f"Unsupported key mode: {key_mode} (use one of: {', '.join(KEY_MODES)})")
+    if key_window <= 0:
+        raise typer.BadParameter(f"--key-window must be positive, got {key_window}")
+    if key_max_windows < 1:
+        raise typer.BadParameter(f"--key-max-windows must be at least 1, got {key_max_windows}")
+    if engine not in ENGINES:
+        raise typer.BadParameter(f"Unsupported engine: {engine} (use one of: {', '.join(ENGINES)})")
+    if engine == "onnx" and model not in ONNX_MODELS:
+        raise typer.BadParameter(f"--engine onnx does not support model '{model}' (use one of: {', '.join(ONNX_MODELS)})")
+
+    if cpu_budget is not None or cpu_cores is not None:
+        try:
+            plan = plan_cpu_budget(cpu_budget, parse_cores(cpu_cores) if cpu_cores else None)
+        except ValueError as e:
+            raise typer.BadParameter(str(e))
+        applied = apply_cpu_budget(plan)
+        onnx_intra_threads = onnx_intra_threads or plan["onnx_intra_threads"]
+        onnx_inter_threads = onnx_inter_threads or plan["onnx_inter_threads"]
+
+        print("\n[bold]== CPU BUDGET ==[/bold]")
+        print(f" Budget:     {plan['budget']} of {plan['available']} available cores")
+        print(f" Separation: {plan['separation_threads']} threads (torch: {applied['torch']}, "
+              f"onnx: intra={onnx_intra_threads} inter={onnx_inter_threads})")
+        print(f" Analysis:   {plan['analysis_threads']} threads (BLAS: {applied['blas']}, numba: {applied['numba']})")
+        print(f" Pinned:     {applied['pinned']}")
 
     out_dir.mkdir(parents=True, exist_ok=True)
 
@@ -122,23 +185,38 @@ def separate(
 
     extract_segment_to_wav(input_file, tmp_wav, start=start, end=end)
 
-    stems_dir = run_demucs(tmp_wav, out_dir=out_dir, model=model)
+    if engine == "onnx":
+        stems_dir = run_demucs_onnx(
+            tmp_wav,
+            out_dir=out_dir,
+            model=model,
+            cache_dir=onnx_cache,
+            quantize=onnx_int8,
+            intra_threads=onnx_intra_threads,
+            inter_threads=onnx_inter_threads,
+        )
+    else:
+        stems_dir = run_demucs(tmp_wav, out_dir=out_dir, model=model)
 
     created = []
     for wav in sorted(stems_dir.glob("*.wav")):
         stem = wav.stem.lower()
-        key = "NA" if stem == "drums" else estimate_key_label_for_wav(wav)
+        est = {"label": "NA"} if stem == "drums" else _estimate_key(wav, key_mode, key_window, key_max_windows)
+        key = est["label"]
         new_name = f"{input_file.stem}__{stem}__key-{key}.wav"
         new_path = stems_dir / new_name
         wav.rename(new_path)
-        created.append((stem, key, new_path))
+        created.append((stem, est, new_path))
 
     if tmp_wav.exists():
         tmp_wav.unlink()
 
     print("\n[bold]== STEMS CREATED ==[/bold]")
-    for stem, key, path in created:
-        print(f" - {stem:>7} | key≈{key:<4} | {path}")
+    for stem, est, path in created:
+        extra = ""
+        if "second" in est and est["label"] != "NA":
+            extra = f" (2nd {est['second']}, conf {est['confidence']:.2f})"
+        print(f" - {stem:>7} | key≈{est['label']:<4}{extra} | {path}")
     print(f"\n[green]Stems written to:[/green] {stems_dir}\n")
 
     if stems_only:
@@ -194,7 +272,7 @@ def separate(
             renamed = 0
             for p in list(Path(out_events).glob(f"{input_file.stem}__{stem}__evt-*.wav")):
                 pitch, _vr = estimate_pitch_note_for_wav(p)
-                k = estimate_key_label_for_wav(p)
+                k = _estimate_key(p, key_mode, key_window, key_max_windows)["label"]
                 p.rename(p.with_name(p.stem + f"__pitch-{pitch}__key-{k}.wav"))
                 renamed += 1
             print(f" - {stem}: onsets={res['onsets']} slices={res['exported']} -> {out_events}")
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import os
+import sys
+
+# Read by the OpenMP/BLAS/numba runtimes when they are loaded, including torch in
+# the Demucs subprocess. ONNX Runtime ignores them and gets explicit thread counts.
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "NUMBA_NUM_THREADS",
+)
+
+def available_cores() -> list[int]:
+    """CPU ids this process may run on (respects taskset/cgroup affinity where supported)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def parse_cores(spec: str) -> list[int]:
+    """Parse a core list like '0-3,8,10-11'."""
+    cores: set[int] = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        lo, sep, hi = part.partition("-")
+        try:
+            a, b = int(lo), int(hi if sep else lo)
+        except ValueError:
+            raise ValueError(f"Invalid core list: {spec!r}") from None
+        if a < 0 or b < a:
+            raise ValueError(f"Invalid core range: {part!r}")
+        cores.update(range(a, b + 1))
+    if not cores:
+        raise ValueError(f"Empty core list: {spec!r}")
+    return sorted(cores)
+
+def plan_cpu_budget(budget: int | None, cores: list[int] | None = None) -> dict:
+    """Decide how many threads each stage may use.
+
+    Separation (Demucs/torch or ONNX Runtime) and analysis (NumPy/BLAS, librosa's
+    numba kernels) run one after the other, so each gets the whole budget rather
+    than competing for it. ONNX Runtime gets the budget as intra-op threads with a
+    single inter-op thread, so the two pools cannot oversubscribe each other.
+    """
+    avail = available_cores()
+    if cores is not None:
+        unknown = sorted(set(cores) - set(avail))
+        if unknown:
+            raise ValueError(f"Cores not available to this process: {unknown} (available: {avail})")
+    pool = cores if cores is not None else avail
+
+    if budget is None:
+        budget = len(pool)
+    if budget < 1:
+        raise ValueError(f"CPU budget must be at least 1, got {budget}")
+    budget = min(budget, len(pool))
+
+    return {
+        "available": len(avail),
+        "budget": budget,
+        "separation_threads": budget,
+        "onnx_intra_threads": budget,
+        "onnx_inter_threads": 1,
+        "analysis_threads": budget,
+        "cores": pool[:budget] if cores is not None else None,
+    }
+
+def apply_cpu_budget(plan: dict) -> dict:
+    """Apply a plan from plan_cpu_budget to this process and its children.
+
+    Returns what was actually applied, per runtime, for reporting.
+    """
+    n = plan["analysis_threads"]
+    applied: dict = {}
+
+    # Children (the Demucs CLI) and runtimes loaded later inherit these.
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(plan["separation_threads"])
+
+    try:
+        from threadpoolctl import threadpool_info, threadpool_limits
+    except ImportError:
+        applied["blas"] = "env only (threadpoolctl not installed)"
+    else:
+        threadpool_limits(limits=n)
+        pools = {f"{p['internal_api']}={p['num_threads']}" for p in threadpool_info()}
+        applied["blas"] = ", ".join(sorted(pools)) or "no pools loaded"
+
+    try:
+        import numba
+    except ImportError:
+        applied["numba"] = "not installed"
+    else:
+        numba.set_num_threads(min(n, numba.config.NUMBA_NUM_THREADS))
+        applied["numba"] = numba.get_num_threads()
+
+    if "torch" in sys.modules:
+        torch = sys.modules["torch"]
+        torch.set_num_threads(plan["separation_threads"])
+        applied["torch"] = torch.get_num_threads()
+    else:
+        applied["torch"] = f"{plan['separation_threads']} (via env)"
+
+    if plan["cores"] is None:
+        applied["pinned"] = "no"
+    elif hasattr(os, "sched_setaffinity"):
+        # Child processes inherit the affinity mask.
+        os.sched_setaffinity(0, plan["cores"])
+        applied["pinned"] = ",".join(str(c) for c in sorted(os.sched_getaffinity(0)))
+    else:
+        applied["pinned"] = "not supported on this platform"
+
+    return applied
@@ -5,6 +5,8 @@ import numpy as np
 import librosa
 import soundfile as sf
 
+from .onsets import detect_onsets, filter_onsets, get_profile, iter_slices, slice_bounds
+
 def _safe_stft_mag(y: np.ndarray, sr: int) -> tuple[np.ndarray, np.ndarray, int]:
     """Return (magnitude_spectrogram, freqs, n_fft) with n_fft chosen to avoid librosa warnings."""
     n = int(y.size)
@@ -51,55 +53,27 @@ def _classify_hit(y: np.ndarray, sr: int) -> str:
 def slice_and_classify_drum_hits(
     drums_wav: Path,
     out_dir: Path,
-    pre_s: float = 0.03,
-    post_s: float = 0.25,
-    min_interval_s: float = 0.06,
+    pre_s: float | None = None,
+    post_s: float | None = None,
+    min_interval_s: float | None = None,
     prefix: str = "track",
 ) -> dict:
-    """Detect onsets, slice hits, classify them, and write WAVs."""
+    """Detect onsets, slice hits, classify them, and write WAVs.
+
+    Parameters left as None come from the "drums" slicing profile.
+    """
+    profile = get_profile("drums", pre_s=pre_s, post_s=post_s, min_interval_s=min_interval_s)
     y, sr = librosa.load(str(drums_wav), sr=None, mono=True)
 
-    onset_frames = librosa.onset.onset_detect(
-        y=y,
-        sr=sr,
-        backtrack=False,
-        units="frames",
-        pre_max=8,
-        post_max=8,
-        pre_avg=16,
-        post_avg=16,
-        delta=0.2,
-        wait=int(max(1, min_interval_s * sr / 512)),
-    )
-    onset_times = librosa.frames_to_time(onset_frames, sr=sr)
-
-    filtered = []
-    last_t = -1e9
-    for t in onset_times:
-        t = float(t)
-        if t - last_t >= min_interval_s:
-            filtered.append(t)
-            last_t = t
-
-    pre_n = int(round(pre_s * sr))
-    post_n = int(round(post_s * sr))
+    onset_times = detect_onsets(y, sr, profile)
+    filtered = filter_onsets(onset_times, profile["min_interval_s"])
+    starts, ends = slice_bounds(filtered, sr, len(y), profile["pre_s"], profile["post_s"])
 
     counts = {"kick": 0, "snare": 0, "hat": 0, "other": 0}
     exported = 0
 
-    for i, t in enumerate(filtered, start=1):
-        center = int(round(t * sr))
-        a = max(0, center - pre_n)
-        b = min(len(y), center + post_n)
-        hit = y[a:b]
-
-        if hit.size > 32:
-            fade = min(64, hit.size // 8)
-            w = np.ones(hit.size, dtype=np.float32)
-            w[:fade] = np.linspace(0.0, 1.0, fade, dtype=np.float32)
-            w[-fade:] = np.linspace(1.0, 0.0, fade, dtype=np.float32)
-            hit = hit.astype(np.float32) * w
-
+    hits = iter_slices(y, starts, ends, profile["max_fade"])
+    for i, (t, hit) in enumerate(zip(filtered, hits), start=1):
         label = _classify_hit(hit, sr)
         counts[label] = counts.get(label, 0) + 1
         exported += 1
@@ -1,41 +1,147 @@
 from pathlib import Path
 import numpy as np
 import librosa
+import soundfile as sf
 
 KRUMHANSL_MAJOR = np.array([6.35,2.23,3.48,2.33,4.38,4.09,2.52,5.19,2.39,3.66,2.29,2.88])
 KRUMHANSL_MINOR = np.array([6.33,2.68,3.52,5.38,2.60,3.53,2.54,4.75,3.98,2.69,3.34,3.17])
 NOTE_NAMES = ["C","C#","D","D#","E","F","F#","G","G#","A","A#","B"]
 
-def _best_key_from_chroma(chroma_mean: np.ndarray) -> str:
+# Candidate labels in the same order the scores are laid out: Cmaj, Cm, C#maj, C#m, ...
+KEY_LABELS = [label for n in NOTE_NAMES for label in (f"{n}maj", f"{n}m")]
+
+KEY_MODES = ("full", "windowed")
+
+def _key_scores(chroma_mean: np.ndarray) -> np.ndarray:
+    """Correlation of a 12-bin chroma vector against all 24 key profiles (KEY_LABELS order)."""
     chroma_mean = chroma_mean / (np.linalg.norm(chroma_mean) + 1e-9)
     maj = KRUMHANSL_MAJOR / np.linalg.norm(KRUMHANSL_MAJOR)
     minr = KRUMHANSL_MINOR / np.linalg.norm(KRUMHANSL_MINOR)
-    best_score = -1e9
-    best_label = "NA"
-    for i in range(12):
-        score_maj = float(chroma_mean @ np.roll(maj, i))
-        score_min = float(chroma_mean @ np.roll(minr, i))
-        if score_maj > best_score:
-            best_score, best_label = score_maj, f"{NOTE_NAMES[i]}maj"
-        if score_min > best_score:
-            best_score, best_label = score_min, f"{NOTE_NAMES[i]}m"
-    return best_label
+    # Row i of each matrix is the profile rolled to tonic i.
+    idx = (np.arange(12)[None, :] - np.arange(12)[:, None]) % 12
+    scores = np.empty(24, dtype=np.float64)
+    scores[0::2] = maj[idx] @ chroma_mean
+    scores[1::2] = minr[idx] @ chroma_mean
+    return scores
 
-def estimate_key_label_for_wav(wav_path: Path) -> str:
+def _best_key_from_chroma(chroma_mean: np.ndarray) -> str:
+    return KEY_LABELS[int(np.argmax(_key_scores(chroma_mean)))]
+
+def _load_for_key(wav_path: Path) -> tuple[np.ndarray, int] | None:
     # Mono + downsample for speed.
     y, sr = librosa.load(str(wav_path), sr=22050, mono=True)
 
     # Very short slices produce unreliable chroma and can trigger librosa STFT warnings.
     # If shorter than ~46ms (1024 samples @ 22050Hz), treat as unknown.
     if len(y) < 1024:
-        return "NA"
+        return None
 
     # Also avoid trying to infer a key from tiny fragments.
     if len(y) < int(sr * 0.20):  # 200ms
-        return "NA"
+        return None
 
     if y.size == 0 or float(np.max(np.abs(y))) < 1e-4:
+        return None
+
+    return y, sr
+
+def estimate_key_label_for_wav(wav_path: Path) -> str:
+    loaded = _load_for_key(wav_path)
+    if loaded is None:
         return "NA"
+    y, sr = loaded
 
     chroma = librosa.feature.chroma_cqt(y=y, sr=sr, tuning=0.0)
     return _best_key_from_chroma(chroma.mean(axis=1))
+
+def _window_energies(wav_path: Path, win_n: int, step: int = 16) -> np.ndarray:
+    """Mean-square energy of each complete `win_n`-sample window at the native rate.
+
+    Blocks are read one window at a time (never the whole file) and the energy is
+    estimated from every `step`-th frame, which is plenty for ranking windows.
+    """
+    energies = []
+    for block in sf.blocks(str(wav_path), blocksize=win_n, dtype="float32", always_2d=True):
+        if block.shape[0] < win_n:
+            break
+        mono = block[::step].mean(axis=1)
+        energies.append(float(np.dot(mono, mono)) / mono.size)
+    return np.asarray(energies, dtype=np.float64)
+
+def _select_energy_windows(energy: np.ndarray, max_windows: int) -> np.ndarray:
+    """Indices of the loudest non-silent windows, in time order."""
+    top = np.argsort(-energy, kind="stable")[:max_windows]
+    # Skip silent windows so quiet intros/outros do not dilute the chroma.
+    top = top[energy[top] > 1e-8]
+    return np.sort(top)
+
+def _read_windows(wav_path: Path, starts: np.ndarray, win_n: int, sr_native: int, sr: int) -> np.ndarray:
+    """Read only the selected windows, downmix and resample them to `sr`. Returns (n, samples)."""
+    windows = []
+    for a in starts:
+        block, _ = sf.read(str(wav_path), start=int(a), frames=win_n, dtype="float32", always_2d=True)
+        windows.append(block.mean(axis=1))
+    y = np.stack(windows)
+    if sr_native != sr:
+        y = librosa.resample(y, orig_sr=sr_native, target_sr=sr, axis=-1)
+    return y
+
+def estimate_key_windowed_for_wav(
+    wav_path: Path,
+    window_s: float = 8.0,
+    max_windows: int = 6,
+) -> dict:
+    """Estimate the key from a bounded number of high-energy windows.
+
+    Windows are picked from a block-wise energy pass at the native sample rate, and
+    only those windows are decoded, resampled and run through the chroma CQT, so the
+    cost stays roughly constant for long stems. Stems that fit in the window budget
+    are analysed in full, like estimate_key_label_for_wav.
+
+    Returns a dict with:
+      label, second: best and runner-up key labels ("NA" if unknown)
+      confidence:    score margin between best and runner-up, relative to the spread
+                     of all 24 key scores, in [0, 1]
+      full:          True if the whole stem was analysed instead of sampled windows
+      windows:       number of sampled windows used (0 when `full` is True)
+    """
+    result = {"label": "NA", "second": "NA", "confidence": 0.0, "full": False, "windows": 0}
+    if window_s <= 0:
+        raise ValueError(f"window_s must be positive, got {window_s}")
+    if max_windows < 1:
+        raise ValueError(f"max_windows must be at least 1, got {max_windows}")
+    sr = 22050
+    max_windows = int(max_windows)
+
+    info = sf.info(str(wav_path))
+    win_n = max(1024, int(round(window_s * info.samplerate)))
+
+    if info.frames <= win_n * max_windows:
+        loaded = _load_for_key(wav_path)
+        if loaded is None:
+            return result
+        y, sr = loaded
+        chroma_mean = librosa.feature.chroma_cqt(y=y, sr=sr, tuning=0.0).mean(axis=1)
+        result["full"] = True
+    else:
+        picked = _select_energy_windows(_window_energies(wav_path, win_n), max_windows)
+        if picked.size == 0:
+            return result
+        windows = _read_windows(wav_path, picked * win_n, win_n, info.samplerate, sr)
+        # librosa treats leading axes as channels, so all windows go through one CQT call.
+        chroma = librosa.feature.chroma_cqt(y=windows, sr=sr, tuning=0.0)
+        chroma_mean = chroma.mean(axis=(0, 2))
+        result["windows"] = int(picked.size)
+
+    scores = _key_scores(chroma_mean)
+    order = np.argsort(-scores, kind="stable")
+    best, second = float(scores[order[0]]), float(scores[order[1]])
+    spread = best - float(scores.min())
+    confidence = (best - second) / spread if spread > 1e-9 else 0.0
+
+    result.update(
+        label=KEY_LABELS[int(order[0])],
+        second=KEY_LABELS[int(order[1])],
+        confidence=float(np.clip(confidence, 0.0, 1.0)),
+    )
+    return result
@@ -6,6 +6,8 @@ import numpy as np
 import librosa
 import soundfile as sf
 
+from .onsets import detect_onsets, filter_onsets, get_profile, iter_slices, slice_bounds
+
 NOTE_NAMES = ["C","C#","D","D#","E","F","F#","G","G#","A","A#","B"]
 
 def _safe_frame_length(n: int, max_frame: int = 2048, min_frame: int = 256) -> int:
@@ -55,62 +57,33 @@ def slice_stem_into_events(
     out_dir: Path,
     prefix: str,
     stem_label: str,
-    pre_s: float = 0.01,
-    post_s: float = 0.6,
-    min_interval_s: float = 0.08,
-    delta: float = 0.15,
+    pre_s: float | None = None,
+    post_s: float | None = None,
+    min_interval_s: float | None = None,
+    delta: float | None = None,
     max_events: int | None = None,
 ) -> dict:
-    y, sr = librosa.load(str(stem_wav), sr=None, mono=True)
+    """Slice a tonal stem at its onsets and write one WAV per event.
 
-    # Separate harmonic/percussive components; detect onsets on harmonic
-    y_harm, _ = librosa.effects.hpss(y)
-    y_onset = y_harm
-
-    onset_frames = librosa.onset.onset_detect(
-        y=y_onset,
-        sr=sr,
-        units="frames",
-        backtrack=False,
-        pre_max=16,
-        post_max=16,
-        pre_avg=32,
-        post_avg=32,
-        delta=delta,
-        wait=int(max(1, min_interval_s * sr / 512)),
+    Parameters left as None come from the slicing profile for `stem_label`.
+    """
+    profile = get_profile(
+        stem_label, pre_s=pre_s, post_s=post_s, min_interval_s=min_interval_s, delta=delta
     )
-    onset_times = librosa.frames_to_time(onset_frames, sr=sr)
+    y, sr = librosa.load(str(stem_wav), sr=None, mono=True)
 
-    filtered: list[float] = []
-    last_t = -1e9
-    for t in onset_times:
-        t = float(t)
-        if t - last_t >= min_interval_s:
-            filtered.append(t)
-            last_t = t
+    onset_times = detect_onsets(y, sr, profile)
+    filtered = filter_onsets(onset_times, profile["min_interval_s"])
 
     if max_events is not None:
         filtered = filtered[:max_events]
 
-    pre_n = int(round(pre_s * sr))
-    post_n = int(round(post_s * sr))
+    starts, ends = slice_bounds(filtered, sr, len(y), profile["pre_s"], profile["post_s"])
 
     exported = 0
     paths: list[Path] = []
-    for i, t in enumerate(filtered, start=1):
-        center = int(round(t * sr))
-        a = max(0, center - pre_n)
-        b = min(len(y), center + post_n)
-        seg = y[a:b]
-
-        # Fade to reduce clicks
-        if seg.size > 32:
-            fade = min(128, seg.size // 8)
-            w = np.ones(seg.size, dtype=np.float32)
-            w[:fade] = np.linspace(0.0, 1.0, fade, dtype=np.float32)
-            w[-fade:] = np.linspace(1.0, 0.0, fade, dtype=np.float32)
-            seg = seg.astype(np.float32) * w
-
+    segments = iter_slices(y, starts, ends, profile["max_fade"])
+    for i, (t, seg) in enumerate(zip(filtered, segments), start=1):
         out_name = f"{prefix}__{stem_label}__evt-{i:04d}__t-{t:0.3f}s.wav"
         out_path = out_dir / out_name
         sf.write(out_path, seg, sr, subtype="PCM_16")
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+from typing import Iterator
+import numpy as np
+import librosa
+
+# Slicing parameters for tonal stems (bass, guitar, piano, vocals, other), and the
+# fallback for any stem without its own entry in PROFILES.
+TONAL_PROFILE = {
+    "pre_s": 0.01,
+    "post_s": 0.60,
+    "min_interval_s": 0.08,
+    "delta": 0.15,
+    "max_fade": 128,
+    "pre_max": 16,
+    "post_max": 16,
+    "pre_avg": 32,
+    "post_avg": 32,
+    # Detect onsets on the harmonic part only (HPSS).
+    "harmonic": True,
+}
+
+# Stems whose slicing differs from TONAL_PROFILE. Callers can still override single
+# values (e.g. from CLI options) through get_profile.
+PROFILES = {
+    "drums": {
+        "pre_s": 0.03,
+        "post_s": 0.25,
+        "min_interval_s": 0.06,
+        "delta": 0.2,
+        "max_fade": 64,
+        "pre_max": 8,
+        "post_max": 8,
+        "pre_avg": 16,
+        "post_avg": 16,
+        "harmonic": False,
+    },
+}
+
+# Number of slices gathered per block; bounds the size of the shared slice buffer
+# and keeps it cache-friendly.
+SLICE_BLOCK = 32
+
+def get_profile(stem: str, **overrides) -> dict:
+    """Slicing parameters for `stem`, with non-None `overrides` applied on top."""
+    profile = dict(PROFILES.get(stem.lower(), TONAL_PROFILE))
+    profile.update({k: v for k, v in overrides.items() if v is not None})
+    return profile
+
+def detect_onsets(y: np.ndarray, sr: int, profile: dict) -> np.ndarray:
+    """Onset times in seconds, detected with the profile's peak-picking parameters."""
+    y_onset = librosa.effects.hpss(y)[0] if profile["harmonic"] else y
+    onset_frames = librosa.onset.onset_detect(
+        y=y_onset,
+        sr=sr,
+        units="frames",
+        backtrack=False,
+        pre_max=profile["pre_max"],
+        post_max=profile["post_max"],
+        pre_avg=profile["pre_avg"],
+        post_avg=profile["post_avg"],
+        delta=profile["delta"],
+        wait=int(max(1, profile["min_interval_s"] * sr / 512)),
+    )
+    return librosa.frames_to_time(onset_frames, sr=sr)
+
+def filter_onsets(onset_times: np.ndarray, min_interval_s: float) -> np.ndarray:
+    """Keep onsets at least `min_interval_s` after the previously kept one (times must be sorted)."""
+    t = np.asarray(onset_times, dtype=np.float64).ravel()
+    if t.size < 2 or np.all(np.diff(t) >= min_interval_s):
+        # Common case: the detector's `wait` already spaced the onsets far enough apart.
+        return t
+
+    keep = []
+    i = 0
+    while i < t.size:
+        keep.append(i)
+        # Jump straight to the first onset far enough from the kept one, then settle
+        # rounding at the boundary with the same `t - last >= min_interval_s` test.
+        j = int(np.searchsorted(t, t[i] + min_interval_s, side="left"))
+        while j > i + 1 and t[j - 1] - t[i] >= min_interval_s:
+            j -= 1
+        while j < t.size and t[j] - t[i] < min_interval_s:
+            j += 1
+        i = max(j, i + 1)
+    return t[keep]
+
+def slice_bounds(
+    onset_times: np.ndarray, sr: int, n_samples: int, pre_s: float, post_s: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """Sample bounds [start, end) of each slice, clipped to the signal."""
+    pre_n = int(round(pre_s * sr))
+    post_n = int(round(post_s * sr))
+    centers = np.rint(np.asarray(onset_times, dtype=np.float64) * sr).astype(np.int64)
+    starts = np.clip(centers - pre_n, 0, n_samples)
+    ends = np.clip(centers + post_n, starts, n_samples)
+    return starts, ends
+
+def _apply_fades(block: np.ndarray, lengths: np.ndarray, max_fade: int) -> None:
+    """Linear fade-in/out over each row's first/last `fade` samples, in place.
+
+    Rows longer than 32 samples fade over min(max_fade, length // 8) samples; shorter
+    rows are left as is.
+    """
+    fade = np.where(lengths > 32, np.minimum(max_fade, lengths // 8), 0)
+    width = int(min(max_fade, block.shape[1]))
+    if width == 0 or not fade.any():
+        return
+    j = np.arange(width)[None, :]
+    denom = np.maximum(fade - 1, 1).astype(np.float32)[:, None]
+    active = j < fade[:, None]
+    gain = np.where(active, j / denom, 1.0).astype(np.float32)
+
+    block[:, :width] *= gain
+    # Mirror the ramp onto each row's tail; inactive positions get unit gain.
+    rows = np.broadcast_to(np.arange(block.shape[0])[:, None], gain.shape)
+    cols = np.where(active, lengths[:, None] - 1 - j, 0)
+    np.multiply.at(block, (rows, cols), gain)
+
+def iter_slices(
+    y: np.ndarray, starts: np.ndarray, ends: np.ndarray, max_fade: int
+) -> Iterator[np.ndarray]:
+    """Yield each slice of `y`, faded to reduce clicks.
+
+    Slices are copied block-wise straight from `y` into one preallocated buffer, so
+    the yielded arrays are views that are only valid until the next one.
+    """
+    lengths = (ends - starts).astype(np.int64)
+    if lengths.size == 0:
+        return
+    y = np.asarray(y, dtype=np.float32)
+    buf = np.zeros((min(SLICE_BLOCK, lengths.size), max(1, int(lengths.max()))), dtype=np.float32)
+
+    for b0 in range(0, lengths.size, SLICE_BLOCK):
+        idx = slice(b0, min(b0 + SLICE_BLOCK, lengths.size))
+        block = buf[: idx.stop - idx.start]
+        # Row-wise copies of in-bounds slices of `y`: no padded copy of the signal and no
+        # (n, width) temporary (np.take on a sliding-window view materialises the view).
+        for row, a, b in zip(block, starts[idx], ends[idx]):
+            row[: b - a] = y[a:b]
+        _apply_fades(block, lengths[idx], max_fade)
+        for row, length in zip(block, lengths[idx]):
+            yield row[:length]
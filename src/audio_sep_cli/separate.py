@@ -26,8 +26,11 @@ def _newest_dir_with_wavs(root: Path, before: set[str], t0: float) -> Path | Non
     candidates.sort(key=lambda d: d.stat().st_mtime, reverse=True)
     return candidates[0]
 
-def run_demucs(input_wav: Path, out_dir: Path, model: str) -> Path:
-    """Runs demucs and returns the directory containing the WAV stems."""
+def run_demucs(input_wav: Path, out_dir: Path, model: str, shifts: int | None = None) -> Path:
+    """Runs demucs and returns the directory containing the WAV stems.
+
+    `shifts` is passed to demucs --shifts when given (0 disables the random time shift).
+    """
     parent_a = out_dir / "separated" / model
     parent_b = out_dir / model
 
@@ -35,7 +38,10 @@ def run_demucs(input_wav: Path, out_dir: Path, model: str) -> Path:
     before_b = _dir_snapshot(parent_b)
     t0 = time.time()
 
-    cmd = ["demucs", "-n", model, "--out", str(out_dir), str(input_wav)]
+    cmd = ["demucs", "-n", model, "--out", str(out_dir)]
+    if shifts is not None:
+        cmd += ["--shifts", str(shifts)]
+    cmd += [str(input_wav)]
     p = subprocess.run(cmd, capture_output=True, text=True)
     if p.returncode != 0:
         raise RuntimeError(f"demucs failed:\n{p.stderr}\n\nstdout:\n{p.stdout}")
@@ -0,0 +1,401 @@
+from __future__ import annotations
+
+from pathlib import Path
+import importlib
+import json
+import math
+import numpy as np
+import soundfile as sf
+
+ENGINES = ("torch", "onnx")
+
+# Pretrained models that --engine onnx can run: the hybrid-transformer (HTDemucs)
+# family, whose network is exported without its STFT/iSTFT.
+ONNX_MODELS = ("htdemucs", "htdemucs_ft", "htdemucs_6s")
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "audio_sep_cli" / "onnx"
+
+# Same chunking as demucs.apply.apply_model defaults.
+OVERLAP = 0.25
+
+_INSTALL_HINTS = {
+    "torch": "pip install demucs  (exporting a model needs PyTorch and Demucs)",
+    "demucs": "pip install demucs  (exporting a model needs PyTorch and Demucs)",
+    "onnx": "pip install \"audio-sep-cli[onnx]\"",
+    "onnxruntime": "pip install \"audio-sep-cli[onnx]\"",
+}
+
+def _require(module: str):
+    try:
+        return importlib.import_module(module)
+    except ImportError as e:
+        package = module.split(".")[0]
+        raise RuntimeError(
+            f"--engine onnx needs the '{package}' package.\n"
+            f"Hint: {_INSTALL_HINTS.get(package, f'pip install {package}')}"
+        ) from e
+
+def _meta_path(cache_dir: Path, model: str) -> Path:
+    return cache_dir / f"{model}.json"
+
+def _onnx_path(cache_dir: Path, model: str, index: int, quantize: bool) -> Path:
+    suffix = ".int8.onnx" if quantize else ".onnx"
+    return cache_dir / f"{model}-{index}{suffix}"
+
+def _htdemucs_core(torch, model):
+    """Wrap an HTDemucs so that only the part between the input STFT and the output iSTFT is traced.
+
+    Inputs are the complex-as-channels spectrogram and the waveform of one training-length
+    chunk; outputs are the per-source spectrogram (still complex-as-channels) and the
+    time-branch waveform. This mirrors HTDemucs.forward in eval mode.
+    """
+    class Core(torch.nn.Module):
+        def __init__(self, m):
+            super().__init__()
+            self.m = m
+
+        def forward(self, mag, mix):
+            m = self.m
+            x = mag
+            B, C, Fq, T = x.shape
+
+            mean = x.mean(dim=(1, 2, 3), keepdim=True)
+            std = x.std(dim=(1, 2, 3), keepdim=True)
+            x = (x - mean) / (1e-5 + std)
+
+            xt = mix
+            meant = xt.mean(dim=(1, 2), keepdim=True)
+            stdt = xt.std(dim=(1, 2), keepdim=True)
+            xt = (xt - meant) / (1e-5 + stdt)
+
+            saved = []
+            saved_t = []
+            lengths = []
+            lengths_t = []
+            for idx, encode in enumerate(m.encoder):
+                lengths.append(x.shape[-1])
+                inject = None
+                if idx < len(m.tencoder):
+                    lengths_t.append(xt.shape[-1])
+                    tenc = m.tencoder[idx]
+                    xt = tenc(xt)
+                    if not tenc.empty:
+                        saved_t.append(xt)
+                    else:
+                        inject = xt
+                x = encode(x, inject)
+                if idx == 0 and m.freq_emb is not None:
+                    frs = torch.arange(x.shape[-2], device=x.device)
+                    emb = m.freq_emb(frs).t()[None, :, :, None].expand_as(x)
+                    x = x + m.freq_emb_scale * emb
+                saved.append(x)
+
+            if m.crosstransformer:
+                if m.bottom_channels:
+                    b, c, f, t = x.shape
+                    x = x.reshape(b, c, f * t)
+                    x = m.channel_upsampler(x)
+                    x = x.reshape(b, -1, f, t)
+                    xt = m.channel_upsampler_t(xt)
+                x, xt = m.crosstransformer(x, xt)
+                if m.bottom_channels:
+                    b, c, f, t = x.shape
+                    x = x.reshape(b, c, f * t)
+                    x = m.channel_downsampler(x)
+                    x = x.reshape(b, -1, f, t)
+                    xt = m.channel_downsampler_t(xt)
+
+            for idx, decode in enumerate(m.decoder):
+                skip = saved.pop(-1)
+                x, pre = decode(x, skip, lengths.pop(-1))
+                offset = m.depth - len(m.tdecoder)
+                if idx >= offset:
+                    tdec = m.tdecoder[idx - offset]
+                    length_t = lengths_t.pop(-1)
+                    if tdec.empty:
+                        pre = pre[:, :, 0]
+                        xt, _ = tdec(pre, None, length_t)
+                    else:
+                        skip = saved_t.pop(-1)
+                        xt, _ = tdec(xt, skip, length_t)
+
+            S = len(m.sources)
+            x = x.view(B, S, -1, Fq, T)
+            x = x * std[:, None] + mean[:, None]
+            xt = xt.view(B, S, -1, mix.shape[-1])
+            xt = xt * stdt[:, None] + meant[:, None]
+            return x, xt
+
+    return Core(model)
+
+def export_demucs_to_onnx(model: str, cache_dir: Path = DEFAULT_CACHE_DIR) -> dict:
+    """Export a pretrained HTDemucs model to ONNX (one graph per model in the bag).
+
+    ONNX has no complex STFT/iSTFT, so only the network between them is exported and
+    the transforms run in NumPy (see _spec/_ispec). The graphs and a JSON sidecar with
+    sources, sample rate, STFT and segment sizes and bag weights are written to
+    `cache_dir`, so later runs only need onnxruntime. Returns the sidecar metadata.
+    Does nothing if the export is already cached.
+    """
+    meta_path = _meta_path(cache_dir, model)
+    if meta_path.exists():
+        return json.loads(meta_path.read_text(encoding="utf-8"))
+
+    if model not in ONNX_MODELS:
+        raise RuntimeError(
+            f"--engine onnx does not support model '{model}' (supported: {', '.join(ONNX_MODELS)}).\n"
+            f"Hint: use --engine torch for this model."
+        )
+
+    torch = _require("torch")
+    pretrained = _require("demucs.pretrained")
+    apply = _require("demucs.apply")
+    htdemucs = _require("demucs.htdemucs")
+
+    bag = pretrained.get_model(model)
+    sub_models = list(bag.models) if isinstance(bag, apply.BagOfModels) else [bag]
+    weights = getattr(bag, "weights", None) or [[1.0] * len(bag.sources) for _ in sub_models]
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    entries = []
+    for i, (sub, w) in enumerate(zip(sub_models, weights)):
+        entries.append(_export_htdemucs(torch, htdemucs, sub, _onnx_path(cache_dir, model, i, quantize=False)))
+        entries[-1]["weights"] = [float(x) for x in w]
+
+    meta = {
+        "model": model,
+        "sources": list(bag.sources),
+        "samplerate": int(bag.samplerate),
+        "audio_channels": int(bag.audio_channels),
+        "models": entries,
+    }
+    # Written last so an interrupted export is retried on the next run.
+    meta_path.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    return meta
+
+def _export_htdemucs(torch, htdemucs, sub, out_path: Path) -> dict:
+    """Export the STFT-free core of one HTDemucs to `out_path`. Returns its sidecar entry."""
+    if not isinstance(sub, htdemucs.HTDemucs) or not sub.cac:
+        raise RuntimeError(f"ONNX export only supports complex-as-channels HTDemucs, got {type(sub).__name__}.")
+
+    sub.eval()
+    segment_len = int(sub.segment * sub.samplerate)
+    nfft, hop = int(sub.nfft), int(sub.hop_length)
+    frames = int(math.ceil(segment_len / hop))
+    mag = torch.zeros(1, sub.audio_channels * 2, nfft // 2, frames)
+    mix = torch.zeros(1, sub.audio_channels, segment_len)
+    # The fused multi-head-attention fast path (aten::_native_multi_head_attention) has
+    # no ONNX symbolic; trace the regular attention ops instead.
+    fastpath = torch.backends.mha.get_fastpath_enabled()
+    torch.backends.mha.set_fastpath_enabled(False)
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                _htdemucs_core(torch, sub),
+                (mag, mix),
+                str(out_path),
+                input_names=["mag", "mix"],
+                output_names=["spec", "wave"],
+                opset_version=17,
+                dynamo=False,
+            )
+    except Exception as e:
+        raise RuntimeError(f"ONNX export failed:\n{e}\n\nHint: use --engine torch for this model.") from e
+    finally:
+        torch.backends.mha.set_fastpath_enabled(fastpath)
+    return {"segment_length": segment_len, "nfft": nfft, "hop_length": hop}
+
+def _quantized(cache_dir: Path, model: str, index: int) -> Path:
+    """Path to the dynamic int8 variant of a cached graph, creating it on first use."""
+    dst = _onnx_path(cache_dir, model, index, quantize=True)
+    if not dst.exists():
+        quantization = _require("onnxruntime.quantization")
+        quantization.quantize_dynamic(
+            str(_onnx_path(cache_dir, model, index, quantize=False)),
+            str(dst),
+            weight_type=quantization.QuantType.QInt8,
+        )
+    return dst
+
+def prepare_onnx_model(model: str, cache_dir: Path = DEFAULT_CACHE_DIR, quantize: bool = False) -> dict:
+    """Make sure the exported (and, if requested, quantized) graphs are cached. Returns the metadata."""
+    meta = export_demucs_to_onnx(model, cache_dir)
+    if quantize:
+        for i in range(len(meta["models"])):
+            _quantized(cache_dir, model, i)
+    return meta
+
+def _make_session(path: Path, intra_threads: int, inter_threads: int):
+    ort = _require("onnxruntime")
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # 0 lets onnxruntime pick (one thread per physical core).
+    opts.intra_op_num_threads = max(0, int(intra_threads))
+    opts.inter_op_num_threads = max(0, int(inter_threads))
+    if inter_threads > 1:
+        opts.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    return ort.InferenceSession(str(path), sess_options=opts, providers=["CPUExecutionProvider"])
+
+def _hann(n: int) -> np.ndarray:
+    # Periodic Hann window, as torch.hann_window.
+    return (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(n) / n)).astype(np.float32)
+
+def _stft(x: np.ndarray, nfft: int, hop: int) -> np.ndarray:
+    """torch.stft(center=True, pad_mode='reflect', normalized=True) over the last axis."""
+    x = np.pad(x, [(0, 0)] * (x.ndim - 1) + [(nfft // 2, nfft // 2)], mode="reflect")
+    frames = np.lib.stride_tricks.sliding_window_view(x, nfft, axis=-1)[..., ::hop, :]
+    z = np.fft.rfft(frames * _hann(nfft), axis=-1) / np.sqrt(nfft)
+    return np.swapaxes(z, -1, -2).astype(np.complex64)
+
+def _istft(z: np.ndarray, hop: int, length: int) -> np.ndarray:
+    """torch.istft(center=True, normalized=True, length=length) over the last two axes."""
+    nfft = 2 * z.shape[-2] - 2
+    window = _hann(nfft)
+    frames = np.fft.irfft(np.swapaxes(z, -1, -2) * np.sqrt(nfft), n=nfft, axis=-1).astype(np.float32)
+    frames *= window
+    n_frames = frames.shape[-2]
+    r = nfft // hop
+
+    # Overlap-add hop-sized pieces: piece k of frame t lands at block t + k.
+    pieces = frames.reshape(frames.shape[:-2] + (n_frames, r, hop))
+    out = np.zeros(frames.shape[:-2] + (n_frames + r - 1, hop), dtype=np.float32)
+    wsq = (window ** 2).reshape(r, hop)
+    env = np.zeros((n_frames + r - 1, hop), dtype=np.float32)
+    for k in range(r):
+        out[..., k : k + n_frames, :] += pieces[..., :, k, :]
+        env[k : k + n_frames] += wsq[k]
+    out = out.reshape(out.shape[:-2] + (-1,))
+    env = env.reshape(-1)
+    out /= np.where(env > 1e-11, env, 1.0)
+
+    out = out[..., nfft // 2 :]
+    if out.shape[-1] < length:
+        out = np.pad(out, [(0, 0)] * (out.ndim - 1) + [(0, length - out.shape[-1])])
+    return out[..., :length]
+
+def _spec(x: np.ndarray, nfft: int, hop: int) -> np.ndarray:
+    # Same framing as HTDemucs._spec: output frames == ceil(length / hop).
+    le = int(math.ceil(x.shape[-1] / hop))
+    pad = hop // 2 * 3
+    x = np.pad(x, [(0, 0)] * (x.ndim - 1) + [(pad, pad + le * hop - x.shape[-1])], mode="reflect")
+    z = _stft(x, nfft, hop)[..., :-1, :]
+    return z[..., 2 : 2 + le]
+
+def _ispec(z: np.ndarray, hop: int, length: int) -> np.ndarray:
+    # Inverse of _spec, as HTDemucs._ispec.
+    z = np.pad(z, [(0, 0)] * (z.ndim - 2) + [(0, 1), (2, 2)])
+    pad = hop // 2 * 3
+    le = hop * int(math.ceil(length / hop)) + 2 * pad
+    x = _istft(z, hop, le)
+    return x[..., pad : pad + length]
+
+def _run_chunk(session, chunk: np.ndarray, nfft: int, hop: int) -> np.ndarray:
+    """Separate one training-length chunk (channels, samples). Returns (sources, channels, samples)."""
+    channels, length = chunk.shape
+    z = _spec(chunk, nfft, hop)
+    # Complex-as-channels: (C, F, T) complex -> (C * 2, F, T) real, re/im interleaved per channel.
+    mag = np.stack([z.real, z.imag], axis=1).reshape(channels * 2, *z.shape[-2:])
+    spec, wave = session.run(None, {"mag": mag[None].astype(np.float32), "mix": chunk[None]})
+    spec = spec[0].reshape(spec.shape[1], channels, 2, *spec.shape[-2:])
+    zout = spec[:, :, 0] + 1j * spec[:, :, 1]
+    return wave[0] + _ispec(zout, hop, length)
+
+def _chunk_weight(segment_len: int) -> np.ndarray:
+    # Triangular overlap-add window, as in demucs.apply.apply_model.
+    half = segment_len // 2
+    w = np.concatenate([np.arange(1, half + 1), np.arange(segment_len - half, 0, -1)]).astype(np.float32)
+    return w / w.max()
+
+def _apply_session(session, mix: np.ndarray, entry: dict, n_sources: int) -> np.ndarray:
+    """Run a fixed-length graph over `mix` (channels, samples) with overlapping chunks."""
+    segment_len = entry["segment_length"]
+    channels, length = mix.shape
+    stride = max(1, int((1 - OVERLAP) * segment_len))
+    weight = _chunk_weight(segment_len)
+
+    out = np.zeros((n_sources, channels, length), dtype=np.float32)
+    total = np.zeros(length, dtype=np.float32)
+    chunk = np.zeros((channels, segment_len), dtype=np.float32)
+
+    for offset in range(0, length, stride):
+        n = min(segment_len, length - offset)
+        # Short chunks are centred in a training-length window with real context
+        # around them where available (demucs.apply.TensorChunk.padded).
+        delta = segment_len - n
+        start = offset - delta // 2
+        a, b = max(0, start), min(length, start + segment_len)
+        chunk.fill(0.0)
+        chunk[:, a - start : b - start] = mix[:, a:b]
+        est = _run_chunk(session, chunk, entry["nfft"], entry["hop_length"])
+        out[..., offset : offset + n] += est[..., delta // 2 : delta // 2 + n] * weight[:n]
+        total[offset : offset + n] += weight[:n]
+
+    out /= np.maximum(total, 1e-8)
+    return out
+
+def separate_with_onnx(
+    mix: np.ndarray,
+    meta: dict,
+    cache_dir: Path,
+    quantize: bool = False,
+    intra_threads: int = 0,
+    inter_threads: int = 0,
+) -> np.ndarray:
+    """Separate a (channels, samples) mix with cached ONNX graphs. Returns (sources, channels, samples)."""
+    model = meta["model"]
+    n_sources = len(meta["sources"])
+
+    # Normalize like demucs.separate: zero-mean/unit-std on the mono reference.
+    ref = mix.mean(axis=0)
+    ref_mean = float(ref.mean())
+    ref_std = float(ref.std(ddof=1)) + 1e-8
+    mix = ((mix - ref_mean) / ref_std).astype(np.float32)
+
+    out = np.zeros((n_sources,) + mix.shape, dtype=np.float32)
+    totals = np.zeros(n_sources, dtype=np.float32)
+    for i, entry in enumerate(meta["models"]):
+        path = _quantized(cache_dir, model, i) if quantize else _onnx_path(cache_dir, model, i, quantize=False)
+        session = _make_session(path, intra_threads, inter_threads)
+        w = np.asarray(entry["weights"], dtype=np.float32)
+        out += _apply_session(session, mix, entry, n_sources) * w[:, None, None]
+        totals += w
+
+    out /= np.maximum(totals, 1e-8)[:, None, None]
+    return out * ref_std + ref_mean
+
+def run_demucs_onnx(
+    input_wav: Path,
+    out_dir: Path,
+    model: str,
+    cache_dir: Path = DEFAULT_CACHE_DIR,
+    quantize: bool = False,
+    intra_threads: int = 0,
+    inter_threads: int = 0,
+) -> Path:
+    """ONNX Runtime counterpart of run_demucs: writes one WAV per source and returns their directory."""
+    meta = prepare_onnx_model(model, cache_dir, quantize=quantize)
+
+    y, sr = sf.read(str(input_wav), dtype="float32", always_2d=True)
+    if sr != meta["samplerate"]:
+        raise RuntimeError(f"Expected {meta['samplerate']} Hz input for '{model}', got {sr} Hz.")
+    mix = y.T
+    if mix.shape[0] != meta["audio_channels"]:
+        mix = np.repeat(mix.mean(axis=0, keepdims=True), meta["audio_channels"], axis=0)
+
+    sources = separate_with_onnx(
+        mix,
+        meta,
+        cache_dir,
+        quantize=quantize,
+        intra_threads=intra_threads,
+        inter_threads=inter_threads,
+    )
+
+    # Same layout as the Demucs CLI: <out>/<model>/<track>/<source>.wav
+    stems_dir = out_dir / model / input_wav.stem
+    stems_dir.mkdir(parents=True, exist_ok=True)
+    for name, src in zip(meta["sources"], sources):
+        # Demucs' default --clip-mode rescale (demucs.audio.prevent_clip).
+        src = src / max(1.01 * float(np.abs(src).max()), 1.0)
+        sf.write(stems_dir / f"{name}.wav", src.T, sr, subtype="PCM_16")
+    return stems_dir